@@ -1,9 +1,13 @@
 import streamlit as st
 import numpy as np
 from PIL import Image, UnidentifiedImageError
-from tensorflow.keras.models import load_model
+from tensorflow.keras.models import load_model, Model
+from tensorflow.keras.layers import GlobalAveragePooling2D
 import gdown
 import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Page configuration ---
 st.set_page_config(page_title="Brain Tumor Detection", layout="wide")
@@ -129,6 +133,7 @@ st.markdown("""
 file_id = '153Pi99NMlc7e-YgHw1V7mW5GZV_B9QJq'
 download_url = f'https://drive.google.com/uc?id={file_id}'
 model_path = "brain_tumor_model.h5"
+ood_index_path = "ood_index.npz"
 class_names = ['glioma', 'meningioma', 'notumor', 'pituitary']
 
 if not os.path.exists(model_path):
@@ -138,13 +143,99 @@ if not os.path.exists(model_path):
             st.error("Gagal mengunduh model.")
             st.stop()
 
+# --- Indeks OOD (centroid per kelas dari data train), dibuat oleh finish_proyek_brain_tumor.py ---
+# Indeks hanya dipakai jika dibuat dari file model yang sama (hash SHA-1) dan urutan kelas yang sama;
+# file yang hilang, rusak, atau tidak cocok tidak menghentikan aplikasi, cukup memakai pemeriksaan warna
+@st.cache_resource
+def load_ood_index(path, model_path):
+    if not os.path.exists(path):
+        print(f"[OOD] {path} tidak ditemukan, memakai pemeriksaan warna sebagai cadangan.")
+        return None
+    try:
+        with np.load(path) as data:
+            index = {key: data[key] for key in data.files}
+        with open(model_path, 'rb') as f:
+            model_sha1 = hashlib.sha1(f.read()).hexdigest()
+        if str(index.get("model_sha1")) != model_sha1:
+            print(f"[OOD] {path} dibuat dari model lain, memakai pemeriksaan warna sebagai cadangan.")
+            return None
+        if list(index["class_names"]) != class_names:
+            print(f"[OOD] Urutan kelas di {path} tidak sama dengan class_names, memakai pemeriksaan warna sebagai cadangan.")
+            return None
+        return {"centroids": index["centroids"], "thresholds": index["thresholds"]}
+    except Exception as e:
+        print(f"[OOD] Gagal membaca {path} ({e}), memakai pemeriksaan warna sebagai cadangan.")
+        return None
+
+# --- Model prediksi; jika indeks OOD tersedia, model dua output: embedding VGG16 (pooling) dan probabilitas kelas dalam satu forward pass ---
+@st.cache_resource
+def load_prediction_model(path, with_embedding):
+    model = load_model(path)
+    if with_embedding:
+        pooling_layer = next((layer for layer in model.layers if isinstance(layer, GlobalAveragePooling2D)), None)
+        if pooling_layer is None:
+            print("[OOD] Layer GlobalAveragePooling2D tidak ditemukan, memakai pemeriksaan warna sebagai cadangan.")
+        else:
+            model = Model(inputs=model.input, outputs=[pooling_layer.output, model.output])
+    # Warm-up agar fungsi prediksi sudah terbentuk sebelum dipanggil dari beberapa thread sekaligus
+    model.predict(np.zeros((1, 224, 224, 3), dtype=np.float32), verbose=0)
+    return model
+
+# --- Executor latar belakang untuk prediksi, dipakai bersama oleh semua sesi ---
+# Beberapa worker agar prediksi antar sesi (dan job lama yang masih berjalan) tidak saling mengantre
+prediction_workers = 4
+
+@st.cache_resource
+def get_prediction_executor():
+    return ThreadPoolExecutor(max_workers=prediction_workers)
+
 try:
-    model = load_model(model_path)
+    ood_index = load_ood_index(ood_index_path, model_path)
+    prediction_model = load_prediction_model(model_path, ood_index is not None)
 except Exception as e:
     st.error(f"Gagal memuat model: {e}")
     st.stop()
-    
-# --- Fungsi untuk cek apakah gambar kemungkinan MRI ---
+
+# Gerbang OOD hanya aktif jika model dua output berhasil dibuat
+if len(prediction_model.outputs) != 2:
+    ood_index = None
+
+# --- Fungsi untuk cek apakah embedding berada di luar distribusi data latih ---
+def is_out_of_distribution(embedding):
+    embedding = embedding / (np.linalg.norm(embedding) + 1e-6)
+    distances = 1.0 - ood_index["centroids"] @ embedding
+    nearest = np.argmin(distances)
+    return distances[nearest] > ood_index["thresholds"][nearest]
+
+# --- Fungsi prediksi yang dijalankan di executor latar belakang (tanpa pemanggilan st.*) ---
+def run_prediction(img):
+    start = time.perf_counter()
+    img_resized = img.resize((224, 224))
+    img_array = np.array(img_resized) / 255.0
+    img_array = np.expand_dims(img_array, axis=0)
+
+    if ood_index is not None:
+        embedding, prediction = prediction_model.predict(img_array, verbose=0)
+        is_ood = bool(is_out_of_distribution(embedding[0]))
+    else:
+        prediction = prediction_model.predict(img_array, verbose=0)
+        is_ood = False
+    pred_index = int(np.argmax(prediction))
+    return {
+        "pred_index": pred_index,
+        "confidence": float(prediction[0][pred_index]),
+        "is_ood": is_ood,
+        "duration": time.perf_counter() - start,
+    }
+
+# --- Fungsi untuk melepas prediksi lama yang sudah tidak relevan ---
+# Job yang masih mengantre dibatalkan; job yang sedang berjalan tidak bisa dihentikan, hasilnya diabaikan
+def cancel_prediction_job():
+    job = st.session_state.pop("prediction_job", None)
+    if job is not None:
+        job["future"].cancel()
+
+# --- Fungsi untuk cek apakah gambar kemungkinan MRI (cadangan jika indeks OOD tidak tersedia) ---
 def is_probably_mri(image_pil):
     if image_pil.width < 100 or image_pil.height < 100:
         return False
@@ -187,23 +278,48 @@ if page == "Home":
     st.markdown('<label for="upload">Upload Gambar MRI</label>', unsafe_allow_html=True)
     uploaded_file = st.file_uploader("", type=["jpg", "jpeg", "png"], key="upload")
 
-    if uploaded_file:
+    if not uploaded_file:
+        cancel_prediction_job()
+    else:
         try:
             img = Image.open(uploaded_file).convert('RGB')
             st.image(img, caption='Gambar yang Diunggah', use_column_width=True)
 
-            if not is_probably_mri(img):
+            if img.width < 100 or img.height < 100 or (ood_index is None and not is_probably_mri(img)):
+                cancel_prediction_job()
                 st.warning("Gambar yang diunggah tidak sesuai dan tidak terdeteksi")
             else:
-                img_resized = img.resize((224, 224))
-                img_array = np.array(img_resized) / 255.0
-                img_array = np.expand_dims(img_array, axis=0)
+                # Kirim prediksi ke executor hanya jika file berganti; job lama dilepas
+                upload_key = uploaded_file.id
+                job = st.session_state.get("prediction_job")
+                if job is None or job["upload_key"] != upload_key:
+                    cancel_prediction_job()
+                    job = {"upload_key": upload_key, "future": get_prediction_executor().submit(run_prediction, img)}
+                    st.session_state["prediction_job"] = job
+
+                # Tampilkan progres selama prediksi berjalan; rerun akibat unggahan baru menghentikan loop ini
+                future = job["future"]
+                if not future.done():
+                    status = st.empty()
+                    progress_bar = st.progress(0)
+                    expected_seconds = st.session_state.get("last_prediction_seconds", 2.0)
+                    start = time.perf_counter()
+                    while not future.done():
+                        elapsed = time.perf_counter() - start
+                        status.markdown(f'<div class="prediction-info">Memproses gambar... {elapsed:.1f} detik</div>', unsafe_allow_html=True)
+                        progress_bar.progress(min(int(elapsed / expected_seconds * 100), 95))
+                        time.sleep(0.1)
+                    status.empty()
+                    progress_bar.empty()
 
-                prediction = model.predict(img_array)
-                pred_index = np.argmax(prediction)
-                confidence = prediction[0][pred_index]
+                result = future.result()
+                st.session_state["last_prediction_seconds"] = result["duration"]
+                pred_index = result["pred_index"]
+                confidence = result["confidence"]
 
-                if confidence < 0.6:
+                if result["is_ood"]:
+                    st.warning("Gambar yang diunggah tidak sesuai dan tidak terdeteksi")
+                elif confidence < 0.6:
                     st.warning("Model tidak yakin dengan prediksi. Silakan coba gambar lain.")
                 else:
                     predicted_class = class_names[pred_index]
@@ -20,6 +20,8 @@ import os
 import shutil
 import random
 import zipfile
+import json
+import hashlib
 
 # Data Manipulation
 import numpy as np
@@ -34,7 +36,6 @@ from PIL import Image
 import cv2
 
 # Machine Learning & Metrics
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import confusion_matrix, classification_report
 
 # TensorFlow and Keras
@@ -51,67 +52,136 @@ from tensorflow.keras import regularizers
 from google.colab import files
 from google.colab import drive
 
-"""## **Data Understanding**
+"""## **Data Understanding & Data Preparation**
 
-*Menghubungkan Google Drive dengan Google Colab agar file dapat diakses secara langsung. File dataset berbentuk ZIP kemudian diekstrak ke direktori yang telah ditentukan di lingkungan Colab. Setelah proses ekstraksi, kode akan menelusuri dan mencetak seluruh path file yang ada di folder hasil ekstrak tersebut.*
+*Menghubungkan Google Drive dengan Google Colab agar file dataset ZIP dapat diakses secara langsung. Alih-alih mengekstrak seluruh ZIP, menggabungkan, lalu membagi ulang data dari awal setiap kali dijalankan, anggota ZIP dibaca langsung dan dicocokkan dengan indeks persisten (`ingest_index.json`) yang menyimpan nama, ukuran, CRC, hash SHA-1, dan split setiap file yang sudah diproses. Hanya file baru atau yang berubah yang ditulis ke folder split train (70%), val (20%), dan test (10%).*
+
+*Folder split beserta indeksnya disimpan di Google Drive (`dataset_root`), bukan di disk lokal Colab yang terhapus setiap kali runtime di-reset, sehingga sesi baru dengan ZIP yang diperbarui hanya memproses file yang berubah. Jika `dataset_root` diarahkan ke disk lokal, sifat inkremental hanya berlaku selama satu runtime.*
+
+*Split ditentukan dari hash isi file sehingga stabil: file yang sudah pernah diproses tetap berada di split yang sama, dan penambahan file baru tidak menggeser file lama. Karena bucket hash berlaku global (tidak distratifikasi per kelas), rasio per kelas hanya mendekati 70/20/10. Jika dua sumber memiliki nama file yang sama untuk kelas yang sama, sumber terakhir di `source_dirs` yang dipakai (sama seperti penyalinan ke folder combined sebelumnya). Jika indeks belum ada, folder split dikosongkan dulu agar sisa pembagian lama tidak tercampur dengan pembagian baru.*
 """
 
 drive.mount('/content/drive')
 
 zip_file_path = '/content/drive/MyDrive/tumor_otak_dataset.zip'
 
-extract_path = '/content/brain_tumor/'
+# Folder split dan indeks disimpan di Google Drive (di samping ZIP) agar tetap ada setelah runtime Colab di-reset
+dataset_root = '/content/drive/MyDrive/brain_tumor'
+split_dataset_dir = os.path.join(dataset_root, "split")
+train_dir = os.path.join(split_dataset_dir, "train")
+val_dir = os.path.join(split_dataset_dir, "val")
+test_dir = os.path.join(split_dataset_dir, "test")
+index_path = os.path.join(split_dataset_dir, "ingest_index.json")
 
-with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-    zip_ref.extractall(extract_path)
+source_dirs = [
+    'dataset_1/Testing',
+    'dataset_1/Training',
+    'dataset_2/Testing',
+    'dataset_2/Training',
+]
 
-# Memeriksa Isi Dataset
-for root, dirs, files in os.walk(extract_path):
-    for name in files:
-        print(os.path.join(root, name))
+classes = ['glioma', 'meningioma', 'notumor', 'pituitary']
 
-"""## **Data Preparation**
+if os.path.exists(index_path):
+    with open(index_path) as f:
+        index = json.load(f)
+else:
+    # Tanpa indeks, isi folder split tidak diketahui asalnya (misalnya hasil train_test_split lama)
+    index = {}
+    for split_dir in [train_dir, val_dir, test_dir]:
+        shutil.rmtree(split_dir, ignore_errors=True)
 
-*Mendefinisikan lokasi folder dataset training dan testing dari dua sumber sebagai langkah awal persiapan data sebelum pengolahan lebih lanjut.*
-"""
+for split_dir in [train_dir, val_dir, test_dir]:
+    for cls in classes:
+        os.makedirs(os.path.join(split_dir, cls), exist_ok=True)
 
-dataset_paths = [
-    '/content/brain_tumor/tumor_otak_dataset/dataset_1/Testing',
-    '/content/brain_tumor/tumor_otak_dataset/dataset_1/Training',
-    '/content/brain_tumor/tumor_otak_dataset/dataset_2/Testing',
-    '/content/brain_tumor/tumor_otak_dataset/dataset_2/Training',
-]
+val_ratio = 0.2
+test_ratio = 0.1
 
-combined_dir = '/content/brain_tumor/tumor_otak_dataset/combined'
+def tentukan_split(file_hash):
+    bucket = int(file_hash[:8], 16) % 1000 / 1000
+    if bucket < test_ratio:
+        return 'test'
+    if bucket < test_ratio + val_ratio:
+        return 'val'
+    return 'train'
 
-classes = ['glioma', 'meningioma', 'notumor', 'pituitary']
-for cls in classes:
-    os.makedirs(os.path.join(combined_dir, cls), exist_ok=True)
+previous_keys = set(index)
+added, changed, restored = set(), set(), set()
 
-for path in dataset_paths:
-    for cls in classes:
-        src_dir = os.path.join(path, cls)
-        dst_dir = os.path.join(combined_dir, cls)
-        if os.path.exists(src_dir):
-            for fname in os.listdir(src_dir):
-                src_file = os.path.join(src_dir, fname)
-                dst_file = os.path.join(dst_dir, fname)
-                shutil.copy2(src_file, dst_file)
+with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+    # Pilih satu anggota ZIP per kelas/nama file; sumber terakhir di source_dirs yang dipakai
+    members = {}
+    for info in zip_ref.infolist():
+        # Format path: tumor_otak_dataset/<dataset>/<Testing|Training>/<kelas>/<file>
+        parts = info.filename.split('/')
+        if info.is_dir() or len(parts) != 5 or '/'.join(parts[1:3]) not in source_dirs:
+            continue
+        cls, fname = parts[3], parts[4]
+        if cls not in classes or not fname.lower().endswith(('.jpg', '.png', '.jpeg')):
+            continue
+
+        key = f"{cls}/{fname}"
+        source = source_dirs.index('/'.join(parts[1:3]))
+        if key not in members or source >= members[key][0]:
+            members[key] = (source, info)
+
+    for key, (_, info) in members.items():
+        entry = index.get(key)
+        target_exists = entry is not None and os.path.exists(os.path.join(split_dataset_dir, entry['split'], key))
+
+        # Lewati file yang tidak berubah (dan masih ada di folder split) tanpa membaca isinya
+        if target_exists and entry['name'] == info.filename and entry['size'] == info.file_size and entry['crc'] == info.CRC:
+            continue
+
+        data = zip_ref.read(info)
+        file_hash = hashlib.sha1(data).hexdigest()
+        if target_exists and entry['hash'] == file_hash:
+            entry.update(name=info.filename, size=info.file_size, crc=info.CRC)
+            continue
+
+        split = entry['split'] if entry else tentukan_split(file_hash)
+        with open(os.path.join(split_dataset_dir, split, key), 'wb') as f:
+            f.write(data)
+
+        index[key] = {'name': info.filename, 'size': info.file_size, 'crc': info.CRC, 'hash': file_hash, 'split': split}
+        if entry is None:
+            added.add(key)
+        elif entry['hash'] != file_hash:
+            changed.add(key)
+        else:
+            restored.add(key)
+
+seen = set(members)
+
+# Hapus file yang sudah tidak ada di ZIP
+removed = previous_keys - seen
+for key in removed:
+    entry = index.pop(key)
+    removed_path = os.path.join(split_dataset_dir, entry['split'], key)
+    if os.path.exists(removed_path):
+        os.remove(removed_path)
+
+with open(index_path, 'w') as f:
+    json.dump(index, f, indent=1)
+
+print(f"Ingest selesai: {len(added)} baru, {len(changed)} berubah, {len(restored)} dipulihkan, {len(removed)} dihapus, "
+      f"{len(seen) - len(added) - len(changed) - len(restored)} tidak berubah.")
+for label, keys in [('Baru', added), ('Berubah', changed), ('Dipulihkan', restored), ('Dihapus', removed)]:
+    for key in sorted(keys):
+        print(f"- {label}: {key}")
 
 """## **Exploratory Data Analysis (EDA)**
 
-*Menampilkan 12 gambar tumor otak secara acak dari dataset gabungan, beserta label kelasnya, untuk memberikan gambaran visual awal data sebelum proses pelatihan model.*
+*Menampilkan 12 gambar tumor otak secara acak dari dataset, beserta label kelasnya, untuk memberikan gambaran visual awal data sebelum proses pelatihan model. Daftar gambar diambil dari indeks ingest sehingga tidak perlu menelusuri ulang folder.*
 """
 
-combined_dir = '/content/brain_tumor/tumor_otak_dataset/combined'
-
 combined_paths = []
 combined_labels = []
 
-for path, subdirs, files in os.walk(combined_dir):
-    for name in files:
-        combined_paths.append(os.path.join(path, name))
-        combined_labels.append(os.path.basename(path))
+for key, entry in index.items():
+    combined_paths.append(os.path.join(split_dataset_dir, entry['split'], key))
+    combined_labels.append(key.split('/')[0])
 
 random_choice = random.sample(range(len(combined_paths)), 12)
 
@@ -130,69 +200,35 @@ for i, idx in enumerate(random_choice):
 plt.tight_layout()
 plt.show()
 
-"""*Menampilkan grafik distribusi jumlah gambar untuk setiap kelas tumor otak di folder gabungan, untuk membantu melihat keseimbangan data sebelum pemodelan.*"""
+"""*Menampilkan grafik distribusi jumlah gambar untuk setiap kelas tumor otak di dataset, untuk membantu melihat keseimbangan data sebelum pemodelan.*"""
 
 distribution_df = pd.DataFrame({'path': combined_paths, 'label': combined_labels})
 
 plt.figure(figsize=(6,6))
 sns.set_style("darkgrid")
 sns.countplot(data=distribution_df, x="label")
-plt.title("Distribusi Gambar per Kelas di Combined Folder")
+plt.title("Distribusi Gambar per Kelas di Dataset")
 plt.xlabel("Kelas")
 plt.ylabel("Jumlah Gambar")
 plt.xticks(rotation=45)
 plt.show()
 
-"""*Menghitung dan menampilkan jumlah gambar untuk setiap kelas tumor di folder gabungan, untuk membantu melihat distribusi data secara keseluruhan.*"""
+"""*Menghitung dan menampilkan jumlah gambar untuk setiap kelas tumor di dataset, untuk membantu melihat distribusi data secara keseluruhan.*"""
 
 distribution_df = pd.DataFrame({'path': combined_paths, 'label': combined_labels})
 
 class_counts = distribution_df['label'].value_counts()
-print("Jumlah data per kelas di folder Combined:")
+print("Jumlah data per kelas di dataset:")
 print(class_counts)
 
 """## **Data Preparation**
 
-*Membagi data gambar tumor otak menjadi tiga bagian menjadi train (70%), val (20%), dan test (10%) untuk setiap kelas tumor. Setelah pembagian, menampilkan jumlah gambar di masing-masing bagian untuk memastikan distribusi data sudah benar.*
+*Menampilkan jumlah gambar di masing-masing bagian train, val, dan test hasil ingest untuk memastikan distribusi data sudah benar.*
 """
 
-combined_dir = '/content/brain_tumor/tumor_otak_dataset/combined'
-
-split_dataset_dir = "/content/brain_tumor/split"
-train_dir = os.path.join(split_dataset_dir, "train")
-val_dir = os.path.join(split_dataset_dir, "val")
-test_dir = os.path.join(split_dataset_dir, "test")
-
-for split_dir in [train_dir, val_dir, test_dir]:
-    os.makedirs(split_dir, exist_ok=True)
-
-val_ratio = 0.2
-test_ratio = 0.1
-
-for class_name in os.listdir(combined_dir):
-    class_path = os.path.join(combined_dir, class_name)
-    if not os.path.isdir(class_path):
-        continue
-
-    files = [f for f in os.listdir(class_path) if f.lower().endswith(('.jpg', '.png', '.jpeg'))]
-
-    train_val_files, test_files = train_test_split(files, test_size=test_ratio, random_state=42)
-
-    val_size_adjusted = val_ratio / (1 - test_ratio)
-    train_files, val_files = train_test_split(train_val_files, test_size=val_size_adjusted, random_state=42)
-
-    def salin(files, destination_dir):
-        os.makedirs(os.path.join(destination_dir, class_name), exist_ok=True)
-        for file in files:
-            src = os.path.join(class_path, file)
-            dst = os.path.join(destination_dir, class_name, file)
-            shutil.copy2(src, dst)
-
-    salin(train_files, train_dir)
-    salin(val_files, val_dir)
-    salin(test_files, test_dir)
-
-print("Dataset berhasil dibagi: 70% train, 20% validation, 10% test.")
+split_totals = pd.Series([entry['split'] for entry in index.values()]).value_counts()
+print("Dataset berhasil dibagi: " + ", ".join(
+    f"{split_totals.get(split, 0) / len(index) * 100:.1f}% {split}" for split in ['train', 'val', 'test']))
 
 for split in ['train', 'val', 'test']:
     split_path = os.path.join(split_dataset_dir, split)
@@ -245,14 +281,14 @@ val_datagen = ImageDataGenerator(rescale=1./255)
 
 # === Load Dataset === #
 train_data = train_datagen.flow_from_directory(
-    '/content/brain_tumor/split/train',
+    train_dir,
     target_size=(224, 224),
     batch_size=32,
     class_mode='categorical'
 )
 
 val_data = val_datagen.flow_from_directory(
-    '/content/brain_tumor/split/val',
+    val_dir,
     target_size=(224, 224),
     batch_size=32,
     class_mode='categorical'
@@ -366,7 +402,7 @@ test_datagen = ImageDataGenerator(rescale=1./255)
 
 # === Load test dataset ===
 test_data = test_datagen.flow_from_directory(
-    '/content/brain_tumor/split/test',
+    test_dir,
     target_size=(224, 224),
     batch_size=32,
     class_mode='categorical',
@@ -416,3 +452,120 @@ plt.show()
 report = classification_report(y_true, y_pred, target_names=classes)
 print("Classification Report:\n", report)
 
+
+
+"""## **Out-of-Distribution (OOD) Index**
+
+*Membangun indeks OOD dari fitur VGG16 yang sudah di-pooling (output GlobalAveragePooling2D) pada data train. Untuk setiap kelas dihitung centroid embedding (dinormalisasi L2) dan ambang jarak kosinus dari persentil ke-99 jarak sampel train ke centroid kelasnya. Indeks disimpan sebagai array `.npz` berukuran kecil sehingga aplikasi bisa langsung memuatnya untuk menolak gambar yang bukan MRI otak.*
+
+*Indeks dibangun dari `brain_tumor_model.h5` yang sama dengan yang diunduh `app.py` (bukan dari `model` hasil training di atas), dan hash SHA-1 file model ikut disimpan agar aplikasi bisa memastikan centroid cocok dengan bobot yang dipakai. File `ood_index.npz` yang dihasilkan **harus di-commit** di samping `app.py`; selama file tersebut belum ada di repositori, aplikasi tetap memakai pemeriksaan warna.*
+"""
+
+import gdown
+from tensorflow.keras.models import load_model
+
+# === Model yang dipakai aplikasi (file_id sama dengan app.py) === #
+deployed_model_path = 'brain_tumor_model.h5'
+gdown.download('https://drive.google.com/uc?id=153Pi99NMlc7e-YgHw1V7mW5GZV_B9QJq', deployed_model_path, quiet=False)
+deployed_model = load_model(deployed_model_path)
+
+with open(deployed_model_path, 'rb') as f:
+    model_sha1 = hashlib.sha1(f.read()).hexdigest()
+
+# === Model embedding dari layer pooling === #
+pooling_layer = next(layer for layer in deployed_model.layers if isinstance(layer, GlobalAveragePooling2D))
+embedding_model = Model(inputs=deployed_model.input, outputs=pooling_layer.output)
+
+ood_datagen = ImageDataGenerator(rescale=1./255)
+ood_train_data = ood_datagen.flow_from_directory(
+    train_dir,
+    target_size=(224, 224),
+    batch_size=32,
+    class_mode='categorical',
+    shuffle=False
+)
+
+train_embeddings = embedding_model.predict(ood_train_data, verbose=1)
+train_embeddings = train_embeddings / (np.linalg.norm(train_embeddings, axis=1, keepdims=True) + 1e-6)
+train_labels = ood_train_data.classes
+ood_classes = sorted(ood_train_data.class_indices, key=ood_train_data.class_indices.get)
+
+# === Centroid dan ambang jarak per kelas === #
+ood_percentile = 99
+centroids = []
+thresholds = []
+for idx in range(len(ood_classes)):
+    class_embeddings = train_embeddings[train_labels == idx]
+    centroid = class_embeddings.mean(axis=0)
+    centroid = centroid / (np.linalg.norm(centroid) + 1e-6)
+    distances = 1.0 - class_embeddings @ centroid
+    centroids.append(centroid)
+    thresholds.append(np.percentile(distances, ood_percentile))
+
+centroids = np.array(centroids, dtype=np.float32)
+thresholds = np.array(thresholds, dtype=np.float32)
+
+np.savez('ood_index.npz', centroids=centroids, thresholds=thresholds, class_names=np.array(ood_classes), model_sha1=np.array(model_sha1))
+
+for cls, threshold in zip(ood_classes, thresholds):
+    print(f"- {cls}: ambang jarak kosinus {threshold:.4f}")
+print(f"Ukuran indeks OOD: {os.path.getsize('ood_index.npz') / 1024:.1f} KB")
+
+"""*Memeriksa indeks OOD dari dua sisi: gambar dianggap OOD jika jarak kosinus ke centroid terdekat melebihi ambang kelas tersebut. Pada data test (MRI otak asli) persentase yang ditolak seharusnya kecil, sedangkan pada gambar non-MRI (folder `gambar/tidak_terdeteksi` dari repositori aplikasi dan beberapa gambar acak sintetis) seharusnya hampir semua ditolak.*
+
+*Catatan: `brain_tumor_model.h5` dilatih dengan pembagian lama (`train_test_split`), sedangkan folder split sekarang dibagi berdasarkan hash. Sebagian besar gambar di `split/test` kemungkinan pernah dipakai untuk melatih model tersebut, sehingga angka false reject di bawah ini cenderung terlalu optimis.*
+"""
+
+def jarak_ood(embeddings):
+    embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-6)
+    distances = 1.0 - embeddings @ centroids.T
+    nearest = np.argmin(distances, axis=1)
+    return distances[np.arange(len(nearest)), nearest] > thresholds[nearest]
+
+# === False reject: MRI otak di data test === #
+rejected = jarak_ood(embedding_model.predict(test_data, verbose=1))
+print(f"Gambar test (MRI) yang ditolak sebagai OOD: {rejected.sum()} dari {len(rejected)} ({rejected.mean()*100:.2f}%)")
+
+# === Deteksi OOD: gambar non-MRI dari repositori aplikasi dan gambar acak === #
+!git clone --depth 1 https://github.com/Evameivina/proyektumor.git /content/proyektumor
+
+non_mri_dir = '/content/proyektumor/gambar/tidak_terdeteksi'
+non_mri_images = [Image.open(os.path.join(non_mri_dir, fname)).convert('RGB') for fname in sorted(os.listdir(non_mri_dir))]
+
+rng = np.random.default_rng(42)
+non_mri_images += [Image.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)) for _ in range(5)]
+non_mri_images += [Image.new('RGB', (224, 224), tuple(int(c) for c in rng.integers(0, 256, 3))) for _ in range(5)]
+
+non_mri_array = np.stack([np.array(img.resize((224, 224))) / 255.0 for img in non_mri_images])
+non_mri_rejected = jarak_ood(embedding_model.predict(non_mri_array, verbose=0))
+print(f"Gambar non-MRI yang ditolak sebagai OOD: {non_mri_rejected.sum()} dari {len(non_mri_rejected)} ({non_mri_rejected.mean()*100:.2f}%)")
+
+"""*Benchmark biaya tambahan gerbang OOD per gambar. Embedding dan probabilitas kelas diambil dari satu forward pass yang sama (model dengan dua output), sehingga biaya tambahannya hanya perbandingan embedding dengan centroid.*"""
+
+import time
+
+dual_model = Model(inputs=deployed_model.input, outputs=[pooling_layer.output, deployed_model.output])
+sample = np.random.rand(1, 224, 224, 3).astype(np.float32)
+n_runs = 50
+
+# Warm-up
+deployed_model.predict(sample, verbose=0)
+dual_model.predict(sample, verbose=0)
+
+start = time.perf_counter()
+for _ in range(n_runs):
+    deployed_model.predict(sample, verbose=0)
+base_ms = (time.perf_counter() - start) / n_runs * 1000
+
+start = time.perf_counter()
+for _ in range(n_runs):
+    embedding, _ = dual_model.predict(sample, verbose=0)
+    embedding = embedding[0] / (np.linalg.norm(embedding[0]) + 1e-6)
+    distances = 1.0 - centroids @ embedding
+    nearest_idx = np.argmin(distances)
+    is_ood = distances[nearest_idx] > thresholds[nearest_idx]
+gated_ms = (time.perf_counter() - start) / n_runs * 1000
+
+print(f"Prediksi tanpa gerbang OOD: {base_ms:.2f} ms/gambar")
+print(f"Prediksi dengan gerbang OOD: {gated_ms:.2f} ms/gambar")
+print(f"Biaya tambahan: {gated_ms - base_ms:.2f} ms/gambar")